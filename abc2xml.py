@@ -17,13 +17,19 @@ See the GNU General Public License for more details. <http://www.gnu.org/license
 from pyparsing import Word, OneOrMore, Optional, Literal, NotAny, MatchFirst
 from pyparsing import Group, oneOf, Suppress, ZeroOrMore, Combine, FollowedBy
 from pyparsing import srange, CharsNotIn, StringEnd, LineEnd, White, Regex
-from pyparsing import nums, alphas, alphanums, ParseException, Forward
+from pyparsing import nums, alphas, alphanums, ParseException, Forward, ParserElement
 try:    import xml.etree.cElementTree as E
 except: import xml.etree.ElementTree as E
-import types, sys, os, re, datetime
+import types, sys, os, re, datetime, bisect
 
 VERSION = 84
 
+packrat = os.environ.get ('ABC2XML_PACKRAT', '')    # packrat memoization: '' = off, 'on' = unbounded cache, <n> = cache size
+if packrat and packrat not in ('0', 'off'):     # off by default, it made abc_voice 2-3 times slower on real tunes
+    ParserElement.enablePackrat (int (packrat) if packrat.isdigit () else None)
+procs = os.environ.get ('ABC2XML_PROCS', '')        # parse the voices of a tune in <n> worker processes, off by default
+procs = int (procs) if procs.isdigit () else 0
+
 python3 = sys.version_info[0] > 2
 lmap = lambda f, xs: list (map (f, xs))   # eager map for python 3
 if python3:
@@ -42,7 +48,10 @@ def info (s, warn=1):
     try: sys.stderr.write (x + '\n')
     except: sys.stderr.write (repr (x) + '\n')
 
+grammars = None         # the grammars are constant: computed once by abc_grammar and shared by all tunes
 def abc_grammar ():     # header, voice and lyrics grammar for ABC
+    global grammars
+    if grammars: return grammars
     #-----------------------------------------------------------------
     # expressions that catch and skip some syntax errors (see corresponding parse expressions)
     #-----------------------------------------------------------------
@@ -89,8 +98,7 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     skip_note   = oneOf ('* - ~')
     extend_note = Literal ('_')
     measure_end = Literal ('|')
-    syl_str     = CharsNotIn ('*~-_| \t\n\\]')
-    syl_chars   = Combine (OneOrMore (syl_str | Regex (r'\\.')))
+    syl_chars   = Regex (r'(?:[^*~\-_| \t\n\\\]]|\\.)+')  # syllable chars or escaped chars
     white       = Word (' \t')
     syllable    = Combine (Optional ('~') + syl_chars + ZeroOrMore (Literal ('~') + syl_chars)) + Optional ('-')
     lyr_elem    = (syllable | skip_note | extend_note | measure_end) + Optional (white).suppress ()
@@ -122,7 +130,7 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     slur_beg = oneOf ("( (, (' .( .(, .('") + ~Word (nums)    # no tuplet_start
     slur_ends = OneOrMore (oneOf (') .)'))
 
-    long_decoration = Combine (oneOf ('! +') + CharsNotIn ('!+ \n') + oneOf ('! +'))
+    long_decoration = Regex (r'[!+][^!+ \n]+[!+]')
     staccato        = Literal ('.') + ~Literal ('|')    # avoid dotted barline
     pizzicato       = Literal ('!+!')   # special case: plus sign is old style deco marker
     decoration      = slur_beg | staccato | userdef_symbol | long_decoration | pizzicato
@@ -138,7 +146,7 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     chord = Suppress ('[') + OneOrMore (chord_note | grace_notes) + Suppress (']') + note_length + Optional (tie) + Optional (slur_ends)
     stem = note | chord | rest
 
-    broken = Combine (OneOrMore ('<') | OneOrMore ('>'))
+    broken = Regex ('<+|>+')
 
     tuplet_num   = Suppress ('(') + number
     tuplet_into  = Suppress (':') + Optional (number, 0)
@@ -157,25 +165,26 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     ninth            = oneOf ('9 ma9 M9 maj9 Maj9 mi9 m9')
     elevn            = oneOf ('11 ma11 M11 maj11 Maj11 mi11 m11')
     suspended        = oneOf ('sus sus2 sus4')
-    chord_degree     = Combine (Optional (chord_accidental) + oneOf ('2 4 5 6 7 9 11 13'))
+    chord_degree     = Regex ('[#b=]?(?:11|13|[245679])')
     chord_kind       = Optional (seventh | sixth | ninth | elevn | triad, '_') + Optional (suspended)
     chord_root       = oneOf ('C D E F G A B') + Optional (chord_accidental)
     chord_bass       = oneOf ('C D E F G A B') + Optional (chord_accidental) # needs a different parse action
     chordsym         = chord_root + chord_kind + ZeroOrMore (chord_degree) + Optional (Suppress ('/') + chord_bass)
     chord_sym        = chordsym + Optional (Literal ('(') + CharsNotIn (')') + Literal (')')).suppress ()
-    chord_or_text    = Suppress ('"') + (chord_sym ^ text_expression) + Suppress ('"')
+    chord_end        = FollowedBy (Literal ('"').leaveWhitespace ())  # chord symbol must fill the whole string
+    chord_or_text    = Suppress ('"') + (chord_sym + chord_end | text_expression) + Suppress ('"')
 
-    volta_nums = Optional ('[').suppress () + Combine (Word (nums) + ZeroOrMore (oneOf (', -') + Word (nums)))
+    volta_nums = Optional ('[').suppress () + Regex (r'\d+(?:[,-]\d+)*')
     volta_text = Literal ('[').suppress () + Regex (r'"[^"]+"')
     volta = volta_nums | volta_text
     invisible_barline = oneOf ('[|] []')
     dashed_barline = oneOf (': .|')
     double_rep = Literal (':') + FollowedBy (':')   # otherwise ambiguity with dashed barline
-    voice_overlay = Combine (OneOrMore ('&'))
+    voice_overlay = Regex ('&+')
     bare_volta = FollowedBy (Literal ('[') + Word (nums))   # no barline, but volta follows (volta is parsed in next measure)
     bar_left = (oneOf ('[|: |: [: :') + Optional (volta)) | Optional ('|').suppress () + volta | oneOf ('| [|')
-    bars = ZeroOrMore (':') + ZeroOrMore ('[') + OneOrMore (oneOf ('| ]'))
-    bar_right = invisible_barline | double_rep | Combine (bars) | dashed_barline | voice_overlay | bare_volta
+    bars = Regex (r':*\[*[|\]]+')
+    bar_right = invisible_barline | double_rep | bars | dashed_barline | voice_overlay | bare_volta
     
     errors =  ~bar_right + Optional (Word (' \n')) + CharsNotIn (':&|', exact=1)
     linebreak = Literal ('$') | ~decorations + Literal ('!')    # no need for I:linebreak !!!
@@ -204,6 +213,16 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     # syntax tree where all tree nodes are instances of pObj
     #----------------------------------------------------------------
 
+    beam = {'prevloc': 0}       # previous match position of a note/rest, only used by the parse actions of this grammar
+    def noteActn (line, loc, t):    # detect beambreak between previous and current note/rest
+        if 'y' in t[0].t: return [] # discard spacer
+        detectBeamBreak (beam, line, loc, t)    # adds beambreak to parse result t as side effect
+        return pObj ('note', t)
+    def restActn (line, loc, t):    # detect beambreak between previous and current note/rest
+        detectBeamBreak (beam, line, loc, t)    # adds beambreak to parse result t as side effect
+        return pObj ('rest', t)
+    abc_voice.beam = beam       # parseSimpleVoice continues with the same note position
+
     ifield.setParseAction (lambda t: pObj ('field', t))
     grand_staff.setParseAction (lambda t: pObj ('grand', t, 1)) # 1 = keep ordered list of results
     brace_gr.setParseAction (lambda t: pObj ('bracegr', t, 1))
@@ -246,59 +265,46 @@ def abc_grammar ():     # header, voice and lyrics grammar for ABC
     b3.setParseAction (errorWarn)
     errors.setParseAction (errorWarn)
 
-    return abc_header, abc_voice, abc_scoredef, abc_percmap
+    grammars = abc_header, abc_voice, abc_scoredef, abc_percmap
+    return grammars
 
 class pObj (object):    # every relevant parse result is converted into a pObj
+    __slots__ = ('name', 't', 'objs', '__dict__')   # the nested pObj's are stored in __dict__
     def __init__ (s, name, t, seq=0):   # t = list of nested parse results
         s.name = name   # name uniqueliy identifies this pObj
         rest = []       # collect parse results that are not a pObj
-        attrs = {}      # new attributes
+        attrs = s.__dict__  # new attributes
         for x in t:     # nested pObj's become attributes of this pObj
-            if type (x) == pObj:
-                attrs [x.name] = attrs.get (x.name, []) + [x]
+            if isinstance (x, pObj):
+                xs = attrs.get (x.name)
+                if xs is None:                  attrs [x.name] = x  # only list if more then one pObj
+                elif type (xs) == list_type:    xs.append (x)
+                else:                           attrs [x.name] = [xs, x]
             else:
                 rest.append (x)             # collect non-pObj's (mostly literals)
-        for name, xs in attrs.items ():
-            if len (xs) == 1: xs = xs[0]    # only list if more then one pObj
-            setattr (s, name, xs)           # create the new attributes
         s.t = rest      # all nested non-pObj's (mostly literals)
         s.objs = seq and t or []            # for nested ordered (lyric) pObj's
 
     def __repr__ (s):   # make a nice string representation of a pObj
         r = []
-        for nm in dir (s):
-            if nm.startswith ('_'): continue # skip build in attributes
-            elif nm == 'name': continue     # redundant
-            else:
-                x = getattr (s, nm)
-                if not x: continue          # s.t may be empty (list of non-pObj's)
-                if type (x) == list_type:  r.extend (x)
-                else:                           r.append (x)
+        for nm in sorted (list (s.__dict__) + ['objs', 't']):  # same order as dir (s), without the build in attributes
+            x = getattr (s, nm)
+            if not x: continue              # s.t may be empty (list of non-pObj's)
+            if type (x) == list_type:  r.extend (x)
+            else:                           r.append (x)
         xs = []
         for x in r:     # recursively call __repr__ and convert all strings to latin-1
             if isinstance (x, str_type): xs.append (x)          # string -> no recursion
             else:                        xs.append (repr (x))   # pObj -> recursive call
         return '(' + s.name + ' ' +','.join (xs) + ')'
 
-global prevloc                  # global to remember previous match position of a note/rest
-prevloc = 0
-def detectBeamBreak (line, loc, t):
-    global prevloc              # location in string 'line' of previous note match
-    xs = line[prevloc:loc+1]    # string between previous and current note match
-    xs = xs.lstrip ()           # first note match starts on a space!
-    prevloc = loc               # location in string 'line' of current note match
-    b = pObj ('bbrk', [' ' in xs])      # space somewhere between two notes -> beambreak
+def detectBeamBreak (beam, line, loc, t):   # beam ['prevloc'] = location in string 'line' of previous note match
+    i = beam ['prevloc']        # skip leading white space, first note match starts on a space!
+    while i < loc and line [i].isspace (): i += 1
+    b = pObj ('bbrk', [line.find (' ', i, loc) >= 0])  # space somewhere between two notes -> beambreak
+    beam ['prevloc'] = loc      # location in string 'line' of current note match
     t.insert (0, b)             # insert beambreak as a nested parse result
 
-def noteActn (line, loc, t):    # detect beambreak between previous and current note/rest
-    if 'y' in t[0].t: return [] # discard spacer
-    detectBeamBreak (line, loc, t)      # adds beambreak to parse result t as side effect
-    return pObj ('note', t)
-
-def restActn (line, loc, t):    # detect beambreak between previous and current note/rest
-    detectBeamBreak (line, loc, t)  # adds beambreak to parse result t as side effect
-    return pObj ('rest', t)
-
 def errorWarn (line, loc, t):   # warning for misplaced symbols and skip them
     if not t[0]: return []      # only warn if catched string not empty
     info ('**misplaced symbol: %s' % t[0], warn=0)
@@ -314,8 +320,14 @@ def errorWarn (line, loc, t):   # warning for misplaced symbols and skip them
 # transformations of a measure (called by parse action doMaat)
 #-------------------------------------------------------------
 
+try:    from math import gcd    # C implementation in python >= 3.5
+except ImportError: from fractions import gcd
+
 def simplify (a, b):    # divide a and b by their greatest common divisor
-    x, y = a, b
+    if type (a) == int_type and type (b) == int_type:
+        g = gcd (a, b)
+        return a // g, b // g
+    x, y = a, b         # floats, e.g. from M:3.5/4, math.gcd only takes integers
     while b: a, b = b, a % b
     return x // a, y // a
 
@@ -342,8 +354,8 @@ def doBroken (prev, brk, x):
 def convertBroken (t):  # convert broken rhythms to normal note durations
     prev = None # the last note/chord before the broken symbol
     brk = ''    # the broken symbol
-    remove = [] # indexes to broken symbols (to be deleted) in measure
-    for i, x in enumerate (t):  # scan all elements in measure
+    out = []    # the measure without broken symbols
+    for x in t: # scan all elements in measure
         if x.name == 'note' or x.name == 'chord' or x.name == 'rest':
             if brk:                 # a broken symbol was encountered before
                 doBroken (prev, brk, x) # change duration previous note/chord/rest and current one
@@ -352,8 +364,9 @@ def convertBroken (t):  # convert broken rhythms to normal note durations
                 prev = x            # remember the last note/chord/rest
         elif x.name == 'broken':
             brk = x.t[0]            # remember the broken symbol (=string)
-            remove.insert (0, i)    # and its index, highest index first
-    for i in remove: del t[i]       # delete broken symbols from high to low
+            continue                # and drop it from the measure
+        out.append (x)
+    if len (out) < len (t): t[:] = out  # replace contents in place, t is a parse result
 
 def ptc2midi (n):       # convert parsed pitch attribute to a midi number
     pt = getattr (n, 'pitch', '')
@@ -368,36 +381,36 @@ def ptc2midi (n):       # convert parsed pitch attribute to a midi number
     return midi
 
 def convertChord (t):   # convert chord to sequence of notes in musicXml-style
-    ins = []
-    for i, x in enumerate (t):
-        if x.name == 'chord':
-            if hasattr (x, 'rest') and not hasattr (x, 'note'): # chords containing only rests
-                if type (x.rest) == list_type: x.rest = x.rest[0] # more rests == one rest
-                ins.insert (0, (i, [x.rest]))   # just output a single rest, no chord
-                continue
-            num1, den1 = x.dur.t                # chord duration
-            tie = getattr (x, 'tie', None)      # chord tie
-            slurs = getattr (x, 'slurs', [])    # slur endings
-            if type (x.note) != list_type: x.note = [x.note]    # when chord has only one note ...
-            elms = []; j = 0                    # sort chord notes, highest first
-            nss = sorted (x.objs, key = ptc2midi, reverse=1) if mxm.orderChords else x.objs
-            for nt in nss:   # all chord elements (note | decorations | rest | grace note)
-                if nt.name == 'note':
-                    num2, den2 = nt.dur.t           # note duration * chord duration
-                    nt.dur.t = simplify (num1 * num2, den1 * den2)
-                    if tie: nt.tie = tie            # tie on all chord notes
-                    if j == 0 and slurs: nt.slurs = slurs   # slur endings only on first chord note
-                    if j > 0: nt.chord = pObj ('chord', [1]) # label all but first as chord notes
-                    else:                           # remember all pitches of the chord in the first note
-                        pitches = [n.pitch for n in x.note] # to implement conversion of erroneous ties to slurs
-                        nt.pitches = pObj ('pitches', pitches)
-                    j += 1
-                if nt.name not in ['dur','tie','slurs','rest']: elms.append (nt)
-            ins.insert (0, (i, elms))           # chord position, [note|decotation|grace note]
-    for i, notes in ins:                        # insert from high to low
-        for nt in reversed (notes):
-            t.insert (i+1, nt)                  # insert chord notes after chord
-        del t[i]                                # remove chord itself
+    out = []; nchord = 0    # the measure with all chords expanded
+    orderChords = mxm.orderChords       # loop invariant
+    for x in t:
+        if x.name != 'chord': out.append (x); continue
+        nchord += 1
+        if hasattr (x, 'rest') and not hasattr (x, 'note'): # chords containing only rests
+            if type (x.rest) == list_type: x.rest = x.rest[0] # more rests == one rest
+            out.append (x.rest)                 # just output a single rest, no chord
+            continue
+        num1, den1 = x.dur.t                    # chord duration
+        tie = getattr (x, 'tie', None)          # chord tie
+        slurs = getattr (x, 'slurs', [])        # slur endings
+        if type (x.note) != list_type: x.note = [x.note]    # when chord has only one note ...
+        j = 0                                   # sort chord notes, highest first
+        nss = sorted (x.objs, key = ptc2midi, reverse=1) if orderChords else x.objs
+        for nt in nss:   # all chord elements (note | decorations | rest | grace note)
+            name = nt.name
+            if name == 'note':
+                dur = nt.dur
+                num2, den2 = dur.t              # note duration * chord duration
+                dur.t = simplify (num1 * num2, den1 * den2)
+                if tie: nt.tie = tie            # tie on all chord notes
+                if j == 0 and slurs: nt.slurs = slurs   # slur endings only on first chord note
+                if j > 0: nt.chord = pObj ('chord', [1]) # label all but first as chord notes
+                else:                           # remember all pitches of the chord in the first note
+                    pitches = [n.pitch for n in x.note] # to implement conversion of erroneous ties to slurs
+                    nt.pitches = pObj ('pitches', pitches)
+                j += 1
+            if name not in ('dur','tie','slurs','rest'): out.append (nt)  # [note|decotation|grace note] replace the chord
+    if nchord: t[:] = out                       # replace contents in place, t is a parse result
 
 def doMaat (t):             # t is a Group() result -> the measure is in t[0]
     convertBroken (t[0])    # remove all broken rhythms and convert to normal durations
@@ -412,30 +425,28 @@ def doGrace (t):        # t is a Group() result -> the grace sequence is in t[0]
 # musicXML generation
 #----------------------------------
 
-def compChordTab ():    # avoid some typing work: returns mapping constant {ABC chordsyms -> musicXML kind}
-    maj, min, aug, dim, dom, ch7, ch6, ch9, ch11, hd = 'major minor augmented diminished dominant -seventh -sixth -ninth -11th half-diminished'.split ()
-    triad   = zip ('ma Maj maj M mi min m aug dim o + -'.split (), [maj, maj, maj, maj, min, min, min, aug, dim, dim, aug, min])
-    seventh = zip ('7 ma7 Maj7 M7 maj7 mi7 m7 dim7 o7 -7 aug7 +7 m7b5 mi7b5'.split (),
-                   [dom, maj+ch7, maj+ch7, maj+ch7, maj+ch7, min+ch7, min+ch7, dim+ch7, dim+ch7, min+ch7, aug+ch7, aug+ch7, hd, hd])
-    sixth   = zip ('6 ma6 M6 mi6 m6'.split (), [maj+ch6, maj+ch6, maj+ch6, min+ch6, min+ch6])
-    ninth   = zip ('9 ma9 M9 maj9 Maj9 mi9 m9'.split (), [dom+ch9, maj+ch9, maj+ch9, maj+ch9, maj+ch9, min+ch9, min+ch9])
-    elevn   = zip ('11 ma11 M11 maj11 Maj11 mi11 m11'.split (), [dom+ch11, maj+ch11, maj+ch11, maj+ch11, maj+ch11, min+ch11, min+ch11])
-    return dict (list (triad) + list (seventh) + list (sixth) + list (ninth) + list (elevn))
+class Indents (dict):   # newline + indentation for each nesting level of the xml tree, computed once per level
+    def __missing__ (s, level):
+        x = s [level] = '\n' + level * '  '   # a negative level gives no indentation, as '\n' + level * '  ' always did
+        return x
+newlines = Indents ()
 
 def addElem (parent, child, level):
-    indent = 2
-    chldrn = parent.getchildren ()
-    if chldrn:
-        chldrn[-1].tail += indent * ' '
+    if len (parent):    # getchildren () would copy all children just to look at the last one
+        parent[-1].tail += '  '
     else:
-        parent.text = '\n' + level * indent * ' '
+        parent.text = newlines [level]
     parent.append (child)
-    child.tail = '\n' + (level-1) * indent * ' '
+    child.tail = newlines [level-1]
 
-def addElemT (parent, tag, text, level):
-    e = E.Element (tag)
+def addElemT (parent, tag, text, level):    # same as addElem, inlined because most elements are added here
+    if len (parent):
+        parent[-1].tail += '  '
+    else:
+        parent.text = newlines [level]
+    e = E.SubElement (parent, tag)
     e.text = text
-    addElem (parent, e, level)
+    e.tail = newlines [level-1]
     return e
     
 def mkTmod (tmnum, tmden, lev):
@@ -464,16 +475,21 @@ def removeElems (root_elem, parent_str, elem_str):
 
 def alignLyr (vce, lyrs):
     empty_el = pObj ('leeg', '*')
+    tgts = []               # syllable receiving notes and right bars, collected once for all lyrics lines
+    for elem in vce:
+        if elem.name == 'note' and not (hasattr (elem, 'chord') or hasattr (elem, 'grace')): tgts.append (elem)
+        elif elem.name == 'rbar': tgts.append (None)
     for k, lyr in enumerate (lyrs): # lyr = one full line of lyrics
         i = 0               # syl counter
-        for elem in vce:    # reiterate the voice block for each lyrics line
-            if elem.name == 'note' and not (hasattr (elem, 'chord') or hasattr (elem, 'grace')):
-                if i >= len (lyr): lr = empty_el
-                else: lr = lyr [i]
-                lr.t[0] = lr.t[0].replace ('%5d',']')
-                elem.objs.append (lr)
-                if lr.name != 'sbar': i += 1
-            if elem.name == 'rbar' and i < len (lyr) and lyr[i].name == 'sbar': i += 1
+        n = len (lyr)
+        for elem in tgts:
+            if elem is None:    # right bar
+                if i < n and lyr[i].name == 'sbar': i += 1
+                continue
+            lr = lyr [i] if i < n else empty_el
+            lr.t[0] = lr.t[0].replace ('%5d',']')
+            elem.objs.append (lr)
+            if lr.name != 'sbar': i += 1
     return vce
 
 slur_move = re.compile (r'(?<![!+])([}><][<>]?)(\)+)')  # (?<!...) means: not preceeded by ...
@@ -485,15 +501,21 @@ def fixSlurs (x):   # repair slurs when after broken sign or grace-close
         return (n * (mo.group (1) + '|')) [:-1]
     def g (mo):     # squash spaces in barline expressions
         return mo.group (1).replace (' ','')
-    x = mm_rest.sub (f, x)
-    x = bar_space.sub (g, x)
-    return slur_move.sub (r'\2\1', x)
-
+    if 'X' in x or 'Z' in x: x = mm_rest.sub (f, x)   # cheap tests before running the regex over the whole voice
+    x = bar_space.sub (g, x)   # separate passes: faster than one alternation regex, and Z0 can join barlines
+    if ')' in x: x = slur_move.sub (r'\2\1', x)
+    return x
+
+abc_comment = re.compile (r'%.*$')                          # comments
+abc_field = re.compile (r'^([A-Zw]:.*$)|\[[A-Zw]:[^]]*]$')  # information field, including lyrics
+field_cont = re.compile (r'^.:(.*?)\\*$')                   # old style \-info-continuation
+key_split = re.compile (r'(\[K:[^]]*\])')                   # first K: ends the header
+inline_any = re.compile (r'\[[A-Z]:[^]]*\]')                # any inline field
+voice_split = re.compile (r'(\[V:[^]]*\])')                 # V-fields, included in the split result
+voice_id = re.compile (r'\[V:\s*(\S*)[ \]]')                # voice id from V: field (skip spaces betwee V: and ID)
+part_mark = re.compile (r'\[P:.\]')                         # P:-marks
 def splitHeaderVoices (abctext):
     escField = lambda x: '[' + x.replace (']',r'%5d') + ']' # hope nobody uses %5d in a field
-    r1 = re.compile (r'%.*$')           # comments
-    r2 = re.compile (r'^([A-Zw]:.*$)|\[[A-Zw]:[^]]*]$')     # information field, including lyrics
-    r3 = re.compile (r'^%%(?=[^%])')    # directive: ^%% folowed by not a %
     xs, nx, mcont, fcont = [], 0, 0, 0  # result lines, X-encountered, music continuation, field continuation
     mln = fln = ''                      # music line, field line
     for x in abctext.splitlines ():
@@ -502,8 +524,8 @@ def splitHeaderVoices (abctext):
         if x.startswith ('X:'):
             if nx == 1: break           # second tune starts without an empty line !!
             nx = 1                      # start first tune
-        x = r3.sub ('I:', x)            # replace %% -> I:
-        x2 = r1.sub ('', x)             # remove comment
+        if x.startswith ('%%') and x[2:3] not in ('', '%'): x = 'I:' + x[2:]  # replace %% -> I:, when %% folowed by not a %
+        x2 = abc_comment.sub ('', x) if '%' in x else x  # remove comment
         while x2.endswith ('*') and not (x2.startswith ('w:') or x2.startswith ('+:') or 'percmap' in x2):
             x2 = x2[:-1]                # remove old syntax for right adjusting
         if not x2: continue             # empty line
@@ -516,11 +538,11 @@ def splitHeaderVoices (abctext):
         if x2[:2] == '+:':              # field continuation
             fln += x2[2:]
             continue
-        ro = r2.match (x2)              # single field on a line
+        ro = abc_field.match (x2)       # single field on a line
         if ro:                          # field -> inline_field, escape all ']'
             if fcont:                   # old style \-info-continuation active
                 fcont = x2 [-1] == '\\' # possible further \-info-continuation
-                fln += re.sub (r'^.:(.*?)\\*$', r'\1', x2) # add continuation, remove .: and \
+                fln += field_cont.sub (r'\1', x2) # add continuation, remove .: and \
                 continue
             if fln: mln += escField (fln)
             if x2.startswith ('['): x2 = x2.strip ('[]')
@@ -543,7 +565,7 @@ def splitHeaderVoices (abctext):
     if fln: mln += escField (fln)
     if mln: xs.append (mln)
 
-    hs = re.split (r'(\[K:[^]]*\])', xs [0])   # look for end of header K:
+    hs = key_split.split (xs [0])               # look for end of header K:
     if len (hs) == 1: header = hs[0]; xs [0] = ''               # no K: present
     else: header = hs [0] + hs [1]; xs [0] = ''.join (hs[2:])   # h[1] is the first K:
     abctext = '\n'.join (xs)                    # the rest is body text
@@ -558,22 +580,21 @@ def splitHeaderVoices (abctext):
 
     xs = abctext.split ('[V:')
     if len (xs) == 1: abctext = '[V:1]' + abctext # abc has no voice defs at all
-    elif re.sub (r'\[[A-Z]:[^]]*\]', '', xs[0]).strip ():   # remove inline fields from starting text, if any
+    elif inline_any.sub ('', xs[0]).strip ():   # remove inline fields from starting text, if any
         abctext = '[V:1]' + abctext     # abc with voices has no V: at start
 
-    r1 = re.compile (r'\[V:\s*(\S*)[ \]]') # get voice id from V: field (skip spaces betwee V: and ID)
     vmap = {}                           # {voice id -> [voice abc string]}
     vorder = {}                         # mark document order of voices
-    xs = re.split (r'(\[V:[^]]*\])', abctext)   # split on every V-field (V-fields included in split result list)
+    xs = voice_split.split (abctext)    # split on every V-field (V-fields included in split result list)
     if len (xs) == 1: raise ValueError ('bugs ...')
     else:
-        pm = re.findall (r'\[P:.\]', xs[0])         # all P:-marks after K: but before first V:
+        pm = part_mark.findall (xs[0])              # all P:-marks after K: but before first V:
         if pm: xs[2] = ''.join (pm) + xs[2]         # prepend P:-marks to the text of the first voice
-        header += re.sub (r'\[P:.\]', '', xs[0])    # clear all P:-marks from text between K: and first V: and put text in the header
+        header += part_mark.sub ('', xs[0])         # clear all P:-marks from text between K: and first V: and put text in the header
         i = 1
         while i < len (xs):             # xs = ['', V-field, voice abc, V-field, voice abc, ...]
             vce, abc = xs[i:i+2]
-            id = r1.search (vce).group (1)                  # get voice ID from V-field
+            id = voice_id.search (vce).group (1)            # get voice ID from V-field
             if not id: id, vce = '1', '[V:1]'               # voice def has no ID
             vmap[id] = vmap.get (id, []) + [vce, abc]       # collect abc-text for each voice id (include V-fields)
             if id not in vorder: vorder [id] = i            # store document order of first occurrence of voice id
@@ -586,30 +607,132 @@ def splitHeaderVoices (abctext):
         voices.append ((id, voice))
     return header, voices
 
-def mergeMeasure (m1, m2, slur_offset, voice_offset, rOpt, is_grand=0):
-    slurs = m2.findall ('note/notations/slur')
-    for slr in slurs:
-        slrnum = int (slr.get ('number')) + slur_offset 
-        slr.set ('number', str (slrnum))    # make unique slurnums in m2
-    vs = m2.findall ('note/voice')          # set all voice number elements in m2
-    for v in vs: v.text  = str (voice_offset + int (v.text))
-    ls = m1.findall ('note/lyric')          # all lyric elements in m1
-    lnum_max = max ([int (l.get ('number')) for l in ls] + [0]) # highest lyric number in m1
-    ls = m2.findall ('note/lyric')          # update lyric elements in m2
-    for el in ls:
-        n = int (el.get ('number'))
-        el.set ('number', str (n + lnum_max))
-    ns = m1.findall ('note')    # determine the total duration of m1, subtract all backups
-    dur1 = sum (int (n.find ('duration').text) for n in ns
-                if n.find ('grace') == None and n.find ('chord') == None)
-    dur1 -= sum (int (b.text) for b in m1.findall ('backup/duration'))
+simple_fld = re.compile (r'[ \t\r\n]*\[([A-Za-z]):([^]]*)\]')         # inline field at the start of a voice
+simple_vid = re.compile (r'[ \t\r\n]*([A-Za-z0-9_]+)')                # voice id at the start of a V: field
+simple_elm = re.compile (r"[ \t\r\n]*(?:(\|)|((\^\^|__|\^|_|=)?([A-Ga-g])(,+|'*)|[xz])(\d*)(/*)(\d*)(-?))")   # barline | note | rest
+def parseSimpleVoice (voice, beam):    # fast path for abc_voice.parseString, returns None when the full grammar is needed
+    def mkStems (stems):        # note and rest parse actions, in document order (detectBeamBreak uses prevloc)
+        xs = []
+        for loc, name, t in stems:
+            t = t[:]
+            detectBeamBreak (beam, voice, loc, t)
+            xs.append (pObj (name, t))
+        return xs
+    voice = voice.expandtabs () # as pyparsing does, locations are used in detectBeamBreak
+    maat, pos = [], 0           # maat = elements of the current measure
+    while 1:                    # only inline fields before the first note
+        mo = simple_fld.match (voice, pos)
+        if not mo: break
+        ftype, fval = mo.groups ()
+        if ftype == 'V':
+            vo = simple_vid.match (fval)
+            if not vo: return None
+            maat.append (pObj ('inline', ['V', vo.group (1), fval [vo.end ():].strip ()]))
+        elif ftype in 'KLMQPITCOAZNGHRBDFSErY':
+            maat.append (pObj ('inline', [ftype, fval.strip ()]))
+        else: return None
+        pos = mo.end ()
+    maten, stems, nstem = [], [], 0     # stems = [(location, name, tokens)] of the notes in the current measure
+    while pos < len (voice):
+        mo = simple_elm.match (voice, pos)
+        if not mo: break
+        bar, stem, acc, step, octs, num, slashes, den, tie = mo.groups ()
+        pos = mo.end ()
+        if bar:
+            if stems:           # end of measure
+                maat += mkStems (stems)
+                maat.append (pObj ('rbar', ['|']))
+                maten.append (maat)
+                maat, stems = [], []
+            elif not maten and not [x for x in maat if x.name == 'lbar']: maat.append (pObj ('lbar', ['|']))
+            else: return None   # empty measure, double barline, etc.
+            continue
+        nstem += 1
+        dur = pObj ('dur', (int (num or 1), (int (den or 2) << len (slashes)) >> 1))
+        if step:
+            oct = len (octs) if "'" in octs else -len (octs)
+            pitch = pObj ('pitch', [acc, step, oct] if acc else [step, oct])
+            t = [pitch, dur, pObj ('tie', [tie])] if tie else [pitch, dur]
+            stems.append ((mo.start (2), 'note', t))
+        elif tie: return None   # no ties on rests
+        else: stems.append ((mo.start (2), 'rest', [stem, dur]))
+    if voice [pos:].strip (' \t\r\n') or not nstem: return None
+    if stems:                   # last measure without barline: parsed twice by the grammar (measure, noBarMeasure)
+        mkStems (stems)         # result dropped on purpose: like the failed measure attempt of the grammar, this leaves
+        maten.append (maat + mkStems (stems))   # beam ['prevloc'] at the last note, which decides the first note's beam break
+    return maten
+
+def parseVoiceJob (job):    # runs in a worker process, returns the parse tree of one voice (None on a syntax error) and the messages
+    global mxm, info
+    voice, orderChords = job
+    msgs = []
+    info = lambda s, warn=1: msgs.append ((s, warn))    # logged by the parent, which may have its own info function
+    if 'mxm' not in globals (): mxm = MusicXml ()   # spawned workers do not inherit the instance of the parent
+    mxm.orderChords = orderChords       # read by the parse action of chords
+    abc_voice = abc_grammar ()[1]
+    abc_voice.beam ['prevloc'] = 0      # a worker may have parsed any other voice before, see parse
+    try:
+        vce = parseSimpleVoice (voice, abc_voice.beam)
+        return (abc_voice.parseString (voice).asList () if vce is None else vce), msgs
+    except ParseException: return None, [] # the parent parses the voice again to report the error
+
+pool = None
+def parseVoices (jobs):     # [(parse tree, messages)] of all voices in parallel, parse tree None for voices that have to be parsed serially
+    global pool
+    if procs < 2 or len (jobs) < 2: return [(None, [])] * len (jobs)
+    if pool is None:
+        import multiprocessing, atexit
+        pool = multiprocessing.Pool (procs)
+        atexit.register (closePool)
+    return pool.map (parseVoiceJob, jobs)
+
+def closePool ():           # stop the worker processes, also called at exit when abc2xml is used as a library
+    global pool
+    if pool is None: return
+    pool.close ()
+    pool.join ()
+    pool = None
+
+def maxSlurNum (e, path='note/notations/slur'):    # highest slur number in element e (measure or part), 0 if none
+    return max ([int (slr.get ('number')) for slr in e.findall (path)] + [0])
+
+def mergeMeasure (m1, m2, slur_offset, voice_offset, rOpt, is_grand=0):   # returns highest slur and voice number merged into m1
+    dur1, lnum_max = 0, 0       # total duration of m1 (all backups subtracted), highest lyric number in m1
+    for e in m1:                # one pass over the notes of m1 and their children
+        if e.tag == 'note':
+            dur, real = 0, 1
+            for c in e:
+                tag = c.tag
+                if tag == 'grace' or tag == 'chord': real = 0  # no real duration
+                elif tag == 'duration': dur = int (c.text)
+                elif tag == 'lyric': lnum_max = max (lnum_max, int (c.get ('number')))
+            if real: dur1 += dur
+        elif e.tag == 'backup':
+            dur1 -= int (e.find ('duration').text)
+    slur_max, vnum_max = 0, 0
     nns, es = 0, []             # nns = number of real notes in m2
-    for e in m2.getchildren (): # scan all elements of m2
-        if e.tag == 'attributes':
+    for e in m2:                # scan all elements of m2, renumber its notes and buffer the elements to be merged
+        if e.tag == 'note':
+            rest = 0
+            for c in e:
+                tag = c.tag
+                if tag == 'voice':              # set all voice number elements in m2
+                    vnum = voice_offset + int (c.text)
+                    c.text = str (vnum)
+                    if vnum > vnum_max: vnum_max = vnum
+                elif tag == 'lyric':            # update lyric elements in m2
+                    c.set ('number', str (int (c.get ('number')) + lnum_max))
+                elif tag == 'notations':
+                    for slr in c.findall ('slur'):
+                        slrnum = int (slr.get ('number')) + slur_offset
+                        slr.set ('number', str (slrnum))    # make unique slurnums in m2
+                        if slrnum > slur_max: slur_max = slrnum
+                elif tag == 'rest': rest = 1
+            if rOpt or not rest: nns += 1
+        elif e.tag == 'attributes':
             if not is_grand: continue # no attribute merging for normal voices
             else: nns += 1       # but we do merge (clef) attributes for a grand staff
-        if e.tag == 'print': continue
-        if e.tag == 'note' and (rOpt or e.find ('rest') == None): nns += 1
+        elif e.tag == 'print': continue
         es.append (e)           # buffer elements to be merged
     if nns > 0:                 # only merge if m2 contains any real notes
         if dur1 > 0:            # only insert backup if duration of m1 > 0
@@ -617,30 +740,34 @@ def mergeMeasure (m1, m2, slur_offset, voice_offset, rOpt, is_grand=0):
             addElem (m1, b, level=3)
             addElemT (b, 'duration', str (dur1), level=4)
         for e in es: addElem (m1, e, level=3)   # merge buffered elements of m2
+        return slur_max, vnum_max
+    return 0, 0                 # nothing merged
 
 def mergePartList (parts, rOpt, is_grand=0):    # merge parts, make grand staff when is_grand true
 
     def delAttrs (part):                # for the time being we only keep clef attributes
         xs = [(m, e) for m in part.findall ('measure') for e in m.findall ('attributes')]
         for m, e in xs:
-            for c in e.getchildren ():
+            for c in list (e):              # copy, e is changed in the loop
                 if c.tag == 'clef': continue    # keep clef attribute
                 if c.tag == 'staff-details': continue    # keep staff-details attribute
                 e.remove (c)                    # delete all other attrinutes for higher staff numbers
-            if len (e.getchildren ()) == 0: m.remove (e)    # remove empty attributes element
+            if len (e) == 0: m.remove (e)    # remove empty attributes element
 
     p1 = parts[0]
+    slur_max = maxSlurNum (p1, 'measure/note/notations/slur')   # find highest slur num in first part
+    vs = p1.findall ('measure/note/voice')                  # all voice number elements in first part
+    vnum_max = max ([int (v.text) for v in vs] + [0])       # highest voice number in first part
     for p2 in parts[1:]:
         if is_grand: delAttrs (p2)                          # delete all attributes except clef
         for i in range (len (p1) + 1, len (p2) + 1):        # second part longer than first one
             maat = E.Element ('measure', number = str(i))   # append empty measures
             addElem (p1, maat, 2)
-        slurs = p1.findall ('measure/note/notations/slur')  # find highest slur num in first part
-        slur_max = max ([int (slr.get ('number')) for slr in slurs] + [0])
-        vs = p1.findall ('measure/note/voice')              # all voice number elements in first part
-        vnum_max = max ([int (v.text) for v in vs] + [0])   # highest voice number in first part
-        for im, m2 in enumerate (p2.findall ('measure')):   # merge all measures of p2 into p1
-            mergeMeasure (p1[im], m2, slur_max, vnum_max, rOpt, is_grand) # may change slur numbers in p1
+        smax, vmax = slur_max, vnum_max                     # offsets stay the same for all measures of p2
+        for m1, m2 in zip (p1, p2.findall ('measure')):     # merge all measures of p2 into p1
+            s2, v2 = mergeMeasure (m1, m2, smax, vmax, rOpt, is_grand)  # may change slur numbers in p1
+            slur_max = max (slur_max, s2)                   # keep the maxima of p1 up to date
+            vnum_max = max (vnum_max, v2)
     return p1
 
 def mergeParts (parts, vids, staves, rOpt, is_grand=0):
@@ -659,11 +786,10 @@ def mergeParts (parts, vids, staves, rOpt, is_grand=0):
             vidsnew.append (vids [pixs[0]])
     return partsnew, vidsnew
 
-def mergePartMeasure (part, msre, ovrlaynum, rOpt):         # merge msre into last measure of part, only for overlays
-    slurs = part.findall ('measure/note/notations/slur')    # find highest slur num in part
-    slur_max = max ([int (slr.get ('number')) for slr in slurs] + [0])
-    last_msre = part.getchildren ()[-1] # last measure in part
-    mergeMeasure (last_msre, msre, slur_max, ovrlaynum, rOpt) # voice offset = s.overlayVNum
+def mergePartMeasure (part, msre, slur_max, ovrlaynum, rOpt):   # merge msre into last measure of part, only for overlays
+    last_msre = part [-1]               # last measure in part, slur_max = highest slur num in part
+    smax, _ = mergeMeasure (last_msre, msre, slur_max, ovrlaynum, rOpt) # voice offset = s.overlayVnum
+    return max (slur_max, smax)         # new highest slur num in part
 
 def setFristVoiceNameFromGroup (vids, vdefs): # vids = [vid], vdef = {vid -> (name, subname, voicedef)}
     vids = [v for v in vids if v in vdefs]  # only consider defined voices
@@ -685,7 +811,7 @@ def mkGrand (p, vdefs):             # transform parse subtree into list needed f
             if x.name == 'grand':   # x.objs contains ordered list of nested parse results within x
                 vids = [y.objs[0] for y in x.objs[1:]]  # the voice ids in the grand staff
                 nms = [vdefs [u][0] for u in vids if u in vdefs] # the names of those voices
-                accept = sum ([1 for nm in nms if nm]) == 1 # accept as grand staff when only one of the voices has a name
+                accept = sum (1 for nm in nms if nm) == 1 # accept as grand staff when only one of the voices has a name
                 if accept or us[0] == '{*':
                     xs.append (us[1:])      # append voice ids as a list (discard first item '{' or '{*')
                     vdefs = setFristVoiceNameFromGroup (vids, vdefs)
@@ -724,18 +850,20 @@ def mkGroups (p):                   # transform parse tree into list needed for
             xs.append (p.t[0])
     return xs
 
+nm7 = 'CDEFGAB'    # the seven note names, indexed by diatonic step
+
 def stepTrans (step, soct, clef):   # [A-G] (1...8)
     if clef.startswith ('bass'):
-        nm7 = 'C,D,E,F,G,A,B'.split (',')
         n = 14 + nm7.index (step) - 12  # two octaves extra to avoid negative numbers
         step, soct = nm7 [n % 7], soct + n // 7 - 2  # subtract two octaves again
     return step, soct
 
 def reduceMids (parts, vidsnew, midiInst):       # remove redundant instruments from a part
+    partInsts = {}                                  # part_id -> instruments of that part, sorted once for all parts
+    for inst in sorted (midiInst.values ()): partInsts.setdefault (inst[0], []).append (inst)
     for pid, part in zip (vidsnew, parts):
         mids, repls, has_perc = {}, {}, 0
-        for ipid, ivid, ch, prg, vol, pan in sorted (list (midiInst.values ())):
-            if ipid != pid: continue                # only instruments from part pid
+        for ipid, ivid, ch, prg, vol, pan in partInsts.get (pid, []): # only instruments from part pid
             if ch == '10': has_perc = 1; continue   # only consider non percussion instruments
             instId, inst = 'I%s-%s' % (ipid, ivid), (ch, prg)
             if inst in mids:                        # midi instrument already defined in this part
@@ -744,7 +872,7 @@ def reduceMids (parts, vidsnew, midiInst):       # remove redundant instruments
             else: mids [inst] = instId              # collect unique instruments in this part
         if len (mids) < 2 and not has_perc:         # only one instrument used -> no instrument tags needed in notes
             removeElems (part, 'measure/note', 'instrument')    # no instrument tag needed for one- or no-instrument parts
-        else:
+        elif repls:                                 # only walk the part when there are Id's to replace
             for e in part.findall ('measure/note/instrument'):
                 id = e.get ('id')                   # replace all redundant instrument Id's
                 if id in repls: e.set ('id', repls [id])
@@ -784,8 +912,38 @@ class stringAlloc:
             return
         xs.append ((t1,t2))
 
+clef_perc = re.compile (r'(perc|map)\s*=\s*(\S*)')                    # perc=on, map=perc in a clef field
+clef_name = re.compile (r'alto1|alto2|alto4|alto|tenor|bass3|bass|treble|perc|none|tab')
+clef_middle = re.compile (r"(?:^m=| m=|middle=)([A-Ga-g])([,']*)")
+clef_octave = re.compile (r'octave=([-+]?\d)')
+clef_trans = re.compile (r'(?:^t=| t=|transpose=)(-?[\d]+)')
+clef_trans_oct = re.compile (r'([+-^_])(8|15)')                       # treble+8, bass-15 etc.
+clef_cue = re.compile (r'cue=(on|off)')
+clef_strings = re.compile (r"strings=(\S+)")
+clef_stafflines = re.compile (r'stafflines=\s*(\d)')
+clef_capo = re.compile (r'capo=(\d+)')
+key_tonic = re.compile (r'\s*([A-G][#b]?)\s*([a-zA-Z]*)')             # tonic and mode of a K: field
+key_alts = re.compile (r'\s((\s?[=^_][A-Ga-g])+)')                    # explicit alterations of a K: field
+key_alt = re.compile (r'([=^_])([A-Ga-g])')                         # (accidental, step) of each alteration
+tempo_val = re.compile (r'(\d)/(\d\d?)\s*=\s*(\d[.\d]*)|(\d[.\d]*)')  # Q:1/4=120 or old style Q:120
+tempo_txt = re.compile (r'"([^"]*)"')
+pfmt_val = re.compile (r'[^.\d]*([\d.]+)\s*(cm|in|pt)?')              # float followed by unit
+perc_head = re.compile (r'(.)-([^x])')                                # abc note head name -> xml
+staff_redir = re.compile (r'staff *([+-]?)(\d)')
+midi_program = re.compile (r'program *(\d*) +(\d+)')
+midi_channel = re.compile (r'channel *(\d+)')
+midi_drummap = re.compile (r"drummap\s+([_=^]*)([A-Ga-g])([,']*)\s+(\d+)")
+midi_control = re.compile (r'control *(\d+) +(\d+)')
+midi_transpose = re.compile (r'transpose[^-\d]*(-?\d+)')
+lyr_tilde = re.compile (r'(?<!\\)~')                                  # ~ in a syllable, when not escaped
+lyr_escape = re.compile (r'\\(.)')                                    # escaped character in a syllable
+lyr_field = re.compile (r'\[\s*w\s*:')                                # inline w: field, the grammar allows spaces
+voice_name = re.compile (r'(?:name|nm)="([^"]*)"')                    # name of a voice in its V: definition
+voice_subname = re.compile (r'(?:subname|snm|sname)="([^"]*)"')
+
 class MusicXml:
     typeMap = {1:'long', 2:'breve', 4:'whole', 8:'half', 16:'quarter', 32:'eighth', 64:'16th', 128:'32nd', 256:'64th'}
+    typeDens = sorted (typeMap)     # legal duration denominators in ascending order
     dynaMap = {'p':1,'pp':1,'ppp':1,'pppp':1,'f':1,'ff':1,'fff':1,'ffff':1,'mp':1,'mf':1,'sfz':1}
     tempoMap = {'larghissimo':40, 'moderato':104, 'adagissimo':44, 'allegretto':112, 'lentissimo':48, 'allegro':120, 'largo':56,
             'vivace':168, 'adagio':59, 'vivo':180, 'lento':62, 'presto':192, 'larghetto':66, 'allegrissimo':208, 'adagietto':76,
@@ -807,10 +965,23 @@ class MusicXml:
     clefLineMap = {'B':'treble', 'G':'alto1', 'E':'alto2', 'C':'alto', 'A':'tenor', 'F':'bass3', 'D':'bass'}
     alterTab = {'=':'0', '_':'-1', '__':'-2', '^':'1', '^^':'2'}
     accTab = {'=':'natural', '_':'flat', '__':'flat-flat', '^':'sharp', '^^':'sharp-sharp'}
-    chordTab = compChordTab ()
+    chordAltTab = {'#':'1', '=':'0', 'b':'-1'}  # alteration of root and degrees in chord symbols
+    semiTab = {'C':0, 'D':2, 'E':4, 'F':5, 'G':7, 'A':9, 'B':11}  # semitones above C for each step
+    percAccTab = {'^':(1, 'x'), '_':(-1, 'circle-x')}   # semitone shift and notehead for unmapped percussion notes
+    chordTab = {'ma':'major', 'Maj':'major', 'maj':'major', 'M':'major', 'mi':'minor', 'min':'minor', 'm':'minor',
+                'aug':'augmented', 'dim':'diminished', 'o':'diminished', '+':'augmented', '-':'minor', '7':'dominant',
+                'ma7':'major-seventh', 'Maj7':'major-seventh', 'M7':'major-seventh', 'maj7':'major-seventh',
+                'mi7':'minor-seventh', 'm7':'minor-seventh', 'dim7':'diminished-seventh', 'o7':'diminished-seventh',
+                '-7':'minor-seventh', 'aug7':'augmented-seventh', '+7':'augmented-seventh', 'm7b5':'half-diminished',
+                'mi7b5':'half-diminished', '6':'major-sixth', 'ma6':'major-sixth', 'M6':'major-sixth', 'mi6':'minor-sixth',
+                'm6':'minor-sixth', '9':'dominant-ninth', 'ma9':'major-ninth', 'M9':'major-ninth', 'maj9':'major-ninth',
+                'Maj9':'major-ninth', 'mi9':'minor-ninth', 'm9':'minor-ninth', '11':'dominant-11th', 'ma11':'major-11th',
+                'M11':'major-11th', 'maj11':'major-11th', 'Maj11':'major-11th', 'mi11':'minor-11th', 'm11':'minor-11th'}
     uSyms = {'~':'roll', 'H':'fermata','L':'>','M':'lowermordent','O':'coda',
              'P':'uppermordent','S':'segno','T':'trill','u':'upbow','v':'downbow'}
     pageFmtDef = [0.75,297,210,18,18,10,10] # the abcm2ps page formatting defaults for A4
+    unitTab = {'cm':10., 'in':25.4, 'pt':25.4/72, None:1.}  # millimeters per unit of a page formatting value
+    pageFmtNms = ('scale', 'pageheight', 'pagewidth', 'leftmargin', 'rightmargin', 'topmargin', 'botmargin') # same order
     metaTab = {'O':'origin', 'A':'area', 'Z':'transcription', 'N':'notes', 'G':'group', 'H':'history', 'R':'rhythm',
                 'B':'book', 'D':'discography', 'F':'fileurl', 'S':'source', 'P':'partmap', 'W':'lyrics'}
     metaMap = {'C':'composer'}  # mapping of composer is fixed
@@ -843,7 +1014,7 @@ class MusicXml:
         s.metadata = {}     # {metadata-type -> string}
         s.lyrdash = {}      # {lyric number -> 1 if dash between syllables}
         s.usrSyms = s.uSyms # user defined symbols
-        s.prevNote = None   # xml element of previous beamed note to correct beams (start, continue)
+        s.prevNote = None   # (xml element, beam element) of previous beamed note to correct beams (start, continue)
         s.grcbbrk = False   # remember any bbrk in a grace sequence
         s.linebrk = 0       # 1 if next measure should start with a line break
         s.nextdecos = []    # decorations for the next note
@@ -886,8 +1057,8 @@ class MusicXml:
             else: step, soct = note, octq
             octnum = (4 if step.upper() == step else 5) + int (soct)
             if not tup: # add percussion map for unmapped notes in this part
-                midi = str (octnum * 12 + [0,2,4,5,7,9,11]['CDEFGAB'.index (step.upper())] + {'^':1,'_':-1}.get (acc, 0) + 12)
-                notehead = {'^':'x', '_':'circle-x'}.get (acc, 'normal')
+                shift, notehead = s.percAccTab.get (acc, (0, 'normal'))
+                midi = str (octnum * 12 + s.semiTab [step.upper ()] + shift + 12)
                 if s.pMapFound: info ('no I:percmap for: %s%s in part %s, voice %s' % (acc+note, -oct*',' if oct<0 else oct*"'", s.pid, s.vid))
                 s.percMap [(s.pid, acc+note, octq)] =  (note, octq, midi, notehead)
             else:       # correct step value for clef
@@ -901,14 +1072,15 @@ class MusicXml:
         pitch = E.Element ('pitch')
         addElemT (pitch, 'step', nUp, lev + 1)
         alter = ''
-        if (note, oct) in s.ties:
-            tied_alter, _, vnum = s.ties [(note,oct)]               # vnum = overlay voice number when tie started
+        tied = s.ties.get ((note, oct))                             # one lookup instead of a test and an index
+        if tied:
+            tied_alter, _, vnum = tied                              # vnum = overlay voice number when tie started
             if vnum == s.overlayVnum: alter = tied_alter            # tied note in the same overlay -> same alteration
         elif acc:
-            s.msreAlts [(nUp, octnum)] = s.alterTab [acc]
             alter = s.alterTab [acc]                                # explicit notated alteration
-        elif (nUp, octnum) in s.msreAlts:   alter = s.msreAlts [(nUp, octnum)]  # temporary alteration
-        elif nUp in s.keyAlts:              alter = s.keyAlts [nUp] # alteration implied by the key
+            s.msreAlts [(nUp, octnum)] = alter
+        else:   # temporary alteration, otherwise the alteration implied by the key (alterations are never empty strings)
+            alter = s.msreAlts.get ((nUp, octnum)) or s.keyAlts.get (nUp, '')
         if alter: addElemT (pitch, 'alter', alter, lev + 1)
         addElemT (pitch, 'octave', str (octnum), lev + 1)
         return pitch, alter, '', ''
@@ -924,6 +1096,8 @@ class MusicXml:
         return decos
 
     def mkNote (s, n, lev):
+        lev1 = lev + 1                  # level of the child elements of the note
+        typeMap = s.typeMap
         isgrace = getattr (n, 'grace', '')
         ischord = getattr (n, 'chord', '')
         if s.ntup >= 0 and not isgrace and not ischord:
@@ -933,7 +1107,8 @@ class MusicXml:
         nnum, nden = n.dur.t            # abc dutation of note
         if s.intrem: nnum += nnum       # double duration of tremolo duplets
         if nden == 0: nden = 1          # occurs with illegal ABC like: "A2 1". Now interpreted as A2/1
-        num, den = simplify (nnum * s.unitLcur[0], nden * s.unitLcur[1])  # normalised with unit length
+        num, den = nnum * s.unitLcur[0], nden * s.unitLcur[1]  # normalised with unit length
+        g = gcd (num, den); num //= g; den //= g    # simplify inline, this runs for every note
         if den > 64:    # limit denominator to 64
             num = int (round (64 * float (num) / den))  # scale note to num/64
             num, den  = simplify (max ([num, 1]), 64)   # smallest num == 1
@@ -942,7 +1117,7 @@ class MusicXml:
               num, den = s.mdur         # duration of one measure
         dvs = (4 * s.divisions * num) // den    # divisions is xml-duration of 1/4
         rdvs = dvs                      # real duration (will be 0 for chord/grace)
-        num, den = simplify (num, den * 4)      # scale by 1/4 for s.typeMap
+        num, den = simplify (num, den * 4)      # scale by 1/4 for s.typeMap, s.mdur can hold floats (M:3.5/4)
         ndot = 0
         if num == 3: ndot = 1; den = den // 2   # look for dotted notes
         if num == 7: ndot = 2; den = den // 4
@@ -950,49 +1125,47 @@ class MusicXml:
         if isgrace:                     # a grace note (and possibly a chord note)
             grace = E.Element ('grace')
             if s.acciatura: grace.set ('slash', 'yes'); s.acciatura = 0
-            addElem (nt, grace, lev + 1)
+            addElem (nt, grace, lev1)
             dvs = rdvs = 0              # no (real) duration for a grace note
             if den <= 16: den = 32      # not longer than 1/8 for a grace note
         if s.gcue_on:                   # insert cue tag
             cue = E.Element ('cue')
-            addElem (nt, cue, lev + 1)
+            addElem (nt, cue, lev1)
         if ischord:                     # a chord note
             chord = E.Element ('chord')
-            addElem (nt, chord, lev + 1)
+            addElem (nt, chord, lev1)
             rdvs = 0                    # chord notes no real duration
-        if den not in s.typeMap:        # take the nearest smaller legal duration
+        if den not in typeMap:          # take the nearest smaller legal duration
             info ('illegal duration %d/%d' % (nnum, nden))
-            den = min (x for x in s.typeMap.keys () if x > den)
-        xmltype = str (s.typeMap [den]) # xml needs the note type in addition to duration
+            den = s.typeDens [bisect.bisect (s.typeDens, den)]
+        xmltype = str (typeMap [den])   # xml needs the note type in addition to duration
         acc, step, oct = '', 'C', '0'   # abc-notated pitch elements (accidental, pitch step, octave)
         alter, midi, notehead = '', '', ''      # xml alteration
         if n.name == 'rest':
             if 'x' in n.t or 'X' in n.t: nt.set ('print-object', 'no')
             rest = E.Element ('rest')
-            addElem (nt, rest, lev + 1)
+            addElem (nt, rest, lev1)
         else:
             p = n.pitch.t           # get pitch elements from parsed tokens
             if len (p) == 3:    acc, step, oct = p
             else:               step, oct = p
-            pitch, alter, midi, notehead = s.mkPitch (acc, step, oct, lev + 1)
+            pitch, alter, midi, notehead = s.mkPitch (acc, step, oct, lev1)
             if midi: acc = ''       # erase accidental for percussion notes
-            addElem (nt, pitch, lev + 1)
+            addElem (nt, pitch, lev1)
         if s.ntup >= 0:                 # modify duration for tuplet notes
             dvs = dvs * s.tmden // s.tmnum
         if dvs:
-            addElemT (nt, 'duration', str (dvs), lev + 1)   # skip when dvs == 0, requirement of musicXML
+            addElemT (nt, 'duration', str (dvs), lev1)      # skip when dvs == 0, requirement of musicXML
             if not ischord: s.gTime = s.gTime [1], s.gTime [1] + dvs
         if (s.midprg != ['', '', '', ''] or midi) and n.name != 'rest': # only add when %%midi was present or percussion
             instId = 'I%s-%s' % (s.pid, 'X' + midi if midi else s.vid)
             chan, midi = ('10', midi) if midi else s.midprg [:2]
             inst = E.Element ('instrument', id=instId)  # instrument id for midi
-            addElem (nt, inst, lev + 1)
+            addElem (nt, inst, lev1)
             if instId not in s.midiInst: s.midiInst [instId] = (s.pid, s.vid, chan, midi, s.midprg [2], s.midprg [3]) # for instrument list in mkScorePart
-        addElemT (nt, 'voice', '1', lev + 1)    # default voice, for merging later
-        addElemT (nt, 'type', xmltype, lev + 1) # add note type
-        for i in range (ndot):          # add dots
-            dot = E.Element ('dot')
-            addElem (nt, dot, lev + 1)
+        addElemT (nt, 'voice', '1', lev1)       # default voice, for merging later
+        addElemT (nt, 'type', xmltype, lev1)    # add note type
+        for i in range (ndot): addElem (nt, E.Element ('dot'), lev1)  # add dots
         ptup = (step, oct)              # pitch tuple without alteration to check for ties
         tstop = ptup in s.ties and s.ties[ptup][2] == s.overlayVnum  # open tie on this pitch tuple in this overlay
         decos = s.getNoteDecos (n)      # get decorations for this note
@@ -1002,31 +1175,31 @@ class MusicXml:
                 e.set ('parentheses', 'yes')
                 decos.remove ('courtesy')
             e.text = s.accTab [acc]
-            addElem (nt, e, lev + 1)
+            addElem (nt, e, lev1)
         tupnotation = ''                # start/stop notation element for tuplets
         if s.ntup >= 0:                 # add time modification element for tuplet notes
-            tmod = mkTmod (s.tmnum, s.tmden, lev + 1)
-            addElem (nt, tmod, lev + 1)
+            tmod = mkTmod (s.tmnum, s.tmden, lev1)
+            addElem (nt, tmod, lev1)
             if s.ntup > 0 and not s.tupnts: tupnotation = 'start'
             s.tupnts.append ((rdvs, tmod))      # remember all tuplet modifiers with corresp. durations
             if s.ntup == 0:             # last tuplet note (and possible chord notes there after)
                 if rdvs: tupnotation = 'stop'   # only insert notation in the real note (rdvs > 0)
-                s.cmpNormType (rdvs, lev + 1)   # compute and/or add normal-type elements (-> s.ntype)
+                s.cmpNormType (rdvs, lev1)      # compute and/or add normal-type elements (-> s.ntype)
         hasStem = 1
         if not ischord: s.chordDecos = {}       # clear on non chord note
         if 'stemless' in decos or (s.nostems and n.name != 'rest') or 'stemless' in s.chordDecos:
             hasStem = 0
-            addElemT (nt, 'stem', 'none', lev + 1)
+            addElemT (nt, 'stem', 'none', lev1)
             if 'stemless' in decos: decos.remove ('stemless')   # do not handle in doNotations
             if hasattr (n, 'pitches'): s.chordDecos ['stemless'] = 1    # set on first chord note
         if notehead:
-            nh = addElemT (nt, 'notehead', re.sub (r'[+-]$', '', notehead), lev + 1)
+            nh = addElemT (nt, 'notehead', re.sub (r'[+-]$', '', notehead), lev1)
             if notehead[-1] in '+-': nh.set ('filled', 'yes' if notehead[-1] == '+' else 'no')
         gstaff = s.gStaffNums.get (s.vid, 0)    # staff number of the current voice
-        if gstaff: addElemT (nt, 'staff', str (gstaff), lev + 1)
-        if hasStem: s.doBeams (n, nt, den, lev + 1)   # no stems -> no beams in a tab staff
-        s.doNotations (n, decos, ptup, alter, tupnotation, tstop, nt, lev + 1)
-        if n.objs: s.doLyr (n, nt, lev + 1)
+        if gstaff: addElemT (nt, 'staff', str (gstaff), lev1)
+        if hasStem: s.doBeams (n, nt, den, lev1)      # no stems -> no beams in a tab staff
+        s.doNotations (n, decos, ptup, alter, tupnotation, tstop, nt, lev1)
+        if n.objs: s.doLyr (n, nt, lev1)
         return nt
 
     def cmpNormType (s, rdvs, lev): # compute the normal-type of a tuplet (only needed for Finale)
@@ -1049,19 +1222,21 @@ class MusicXml:
         if pts:                                     # make list of pitches in chord: [(pitch, octave), ..]
             if type (pts.pitch) == pObj: pts = [pts.pitch]      # chord with one note
             else: pts = [tuple (p.t[-2:]) for p in pts.pitch]   # normal chord
-        for pt, (tie_alter, nts, vnum) in sorted (list (s.ties.items ())):  # scan all open ties and delete illegal ones
-            if vnum != s.overlayVnum: continue      # tie belongs to different overlay
-            if pts and pt in pts: continue          # pitch tuple of tie exists in chord
-            if getattr (n, 'chord', 0): continue    # skip chord notes
-            if pt == ptup: continue                 # skip correct single note tie
-            if getattr (n, 'grace', 0): continue    # skip grace notes
+        if s.ties and not getattr (n, 'chord', 0) and not getattr (n, 'grace', 0): # skip chord notes and grace notes
+            badties = [pt for pt, (tie_alter, nts, vnum) in s.ties.items ()    # scan all open ties for illegal ones
+                       if vnum == s.overlayVnum         # tie belongs to this overlay
+                       and not (pts and pt in pts)      # pitch tuple of tie does not exist in chord
+                       and pt != ptup]                  # not a correct single note tie
+        else: badties = []
+        for pt in sorted (badties):                 # delete the illegal ties
+            tie_alter, nts, vnum = s.ties.pop (pt)  # remove the note from pending ties
             info ('tie between different pitches: %s%s converted to slur' % pt)
-            del s.ties [pt]                         # remove the note from pending ties
             e = [t for t in nts.findall ('tied') if t.get ('type') == 'start'][0]   # get the tie start element
             e.tag = 'slur'                          # convert tie into slur
             slurnum = len (s.slurstack) + 1
             s.slurstack.append (slurnum)
             e.set ('number', str (slurnum))
+            s.tieslur = 1                           # the slur may be in a measure already added to the part
             if slurs: slurs.t.append (')')          # close slur on this note
             else: slurs = pObj ('slurs', [')'])
         tstart = getattr (n, 'tie', 0)  # start a new tie
@@ -1128,7 +1303,7 @@ class MusicXml:
             if ',' in stp: ntn.set ('placement', 'below')
             if "'" in stp: ntn.set ('placement', 'above')
             addElem (nots, ntn, lev + 1)            
-        if nots.getchildren() != []:    # only add notations if not empty
+        if len (nots):                  # only add notations if not empty
             addElem (nt, nots, lev)
 
     def doArticulations (s, nt, nots, arts, lev):
@@ -1200,8 +1375,8 @@ class MusicXml:
             addElem (nt, lyrel, lev)
             addElemT (lyrel, 'syllabic', type, lev + 1)
             txt = lyrobj.t[0]                       # the syllabe
-            txt = re.sub (r'(?<!\\)~', ' ', txt)    # replace ~ by space when not escaped (preceded by \)
-            txt = re.sub (r'\\(.)', r'\1', txt)     # replace all escaped characters by themselves (for the time being)
+            if '~' in txt: txt = lyr_tilde.sub (' ', txt)       # replace ~ by space when not escaped (preceded by \)
+            if '\\' in txt: txt = lyr_escape.sub (r'\1', txt)   # replace all escaped characters by themselves (for the time being)
             addElemT (lyrel, 'text', txt, lev + 1)
 
     def doBeams (s, n, nt, den, lev):
@@ -1210,30 +1385,22 @@ class MusicXml:
             return
         bbrk = s.grcbbrk or n.bbrk.t[0] or den < 32
         s.grcbbrk = False
-        if not s.prevNote:  pbm = None
-        else:               pbm = s.prevNote.find ('beam')
         bm = E.Element ('beam', number='1')
         bm.text = 'begin'
-        if pbm != None:
-            if bbrk:
-                if pbm.text == 'begin':
-                    s.prevNote.remove (pbm)
-                elif pbm.text == 'continue':
-                    pbm.text = 'end'
-                s.prevNote = None
+        if s.prevNote:
+            if bbrk: s.stopBeams ()
             else: bm.text = 'continue'
         if den >= 32 and n.name != 'rest':
             addElem (nt, bm, lev)
-            s.prevNote = nt
+            s.prevNote = (nt, bm)
 
     def stopBeams (s):
         if not s.prevNote: return
-        pbm = s.prevNote.find ('beam')
-        if pbm != None:
-            if pbm.text == 'begin':
-                s.prevNote.remove (pbm)
-            elif pbm.text == 'continue':
-                pbm.text = 'end'
+        pnt, pbm = s.prevNote
+        if pbm.text == 'begin':
+            pnt.remove (pbm)
+        elif pbm.text == 'continue':
+            pbm.text = 'end'
         s.prevNote = None
 
     def staffDecos (s, decos, maat, lev):
@@ -1287,20 +1454,20 @@ class MusicXml:
             addElemT (e, 'chromatic', n, lev + 2)  # n == signed number string given after transpose
             atts.append ((9, e))
         def doClef (field):
-            if re.search (r'perc|map', field):  # percussion clef or new style perc=on or map=perc
-                r = re.search (r'(perc|map)\s*=\s*(\S*)', field)
+            if 'perc' in field or 'map' in field:  # percussion clef or new style perc=on or map=perc
+                r = clef_perc.search (field)
                 s.percVoice = 0 if r and r.group (2) not in ['on','true','perc'] else 1
-                field = re.sub (r'(perc|map)\s*=\s*(\S*)', '', field)   # erase the perc= for proper clef matching
+                field = clef_perc.sub ('', field)   # erase the perc= for proper clef matching
             clef, gtrans = 0, 0
-            clefn = re.search (r'alto1|alto2|alto4|alto|tenor|bass3|bass|treble|perc|none|tab', field)
-            clefm = re.search (r"(?:^m=| m=|middle=)([A-Ga-g])([,']*)", field)
-            trans_oct2 = re.search (r'octave=([-+]?\d)', field)
-            trans = re.search (r'(?:^t=| t=|transpose=)(-?[\d]+)', field)
-            trans_oct = re.search (r'([+-^_])(8|15)', field)
-            cue_onoff = re.search (r'cue=(on|off)', field)
-            strings = re.search (r"strings=(\S+)", field)
-            stafflines = re.search (r'stafflines=\s*(\d)', field)
-            capo = re.search (r'capo=(\d+)', field)
+            clefn = clef_name.search (field)
+            clefm = clef_middle.search (field)
+            trans_oct2 = clef_octave.search (field)
+            trans = clef_trans.search (field)
+            trans_oct = clef_trans_oct.search (field)
+            cue_onoff = clef_cue.search (field)
+            strings = clef_strings.search (field)
+            stafflines = clef_stafflines.search (field)
+            capo = clef_capo.search (field)
             if clefn:
                 clef = clefn.group ()
             if clefm:
@@ -1391,8 +1558,8 @@ class MusicXml:
             elif ftype == 'K':
                 accs = ['F','C','G','D','A','E','B']    # == s.sharpness [7:14]
                 mode = ''
-                key = re.match (r'\s*([A-G][#b]?)\s*([a-zA-Z]*)', field)
-                alts = re.search (r'\s((\s?[=^_][A-Ga-g])+)', ' ' + field)  # avoid matching middle=G and m=G
+                key = key_tonic.match (field)
+                alts = key_alts.search (' ' + field)  # avoid matching middle=G and m=G
                 if key:
                     key, mode = key.groups ()
                     mode = mode.lower ()[:3] # only first three chars, no case
@@ -1404,23 +1571,19 @@ class MusicXml:
                     fifths = 0
                     mode = 'maj'
                 if alts:
-                    alts = re.findall (r'[=^_][A-Ga-g]', alts.group(1)) # list of explicit alterations
-                    alts = [(x[1], s.alterTab [x[0]]) for x in alts]    # [step, alter]
+                    alts = [(step, s.alterTab [acc]) for acc, step in key_alt.findall (alts.group(1))] # explicit alterations [step, alter]
                     for step, alter in alts:                # correct permanent alterations for this key
                         s.keyAlts [step.upper ()] = alter
-                    k = E.Element ('key')
-                    koctave = []
-                    lowerCaseSteps = [step.upper () for step, alter in alts if step.islower ()]
-                    for step, alter in sorted (list (s.keyAlts.items ())):
-                        if alter == '0':                    # skip neutrals
-                            del s.keyAlts [step.upper ()]   # otherwise you get neutral signs on normal notes
-                            continue
-                        addElemT (k, 'key-step', step.upper (), lev + 2)
-                        addElemT (k, 'key-alter', alter, lev + 2)
-                        koctave.append ('5' if step in lowerCaseSteps else '4')
-                    if koctave:                     # only key signature if not empty
-                        for oct in koctave:
-                            e = E.Element ('key-octave', number=oct)
+                    s.keyAlts = {step: alter for step, alter in s.keyAlts.items () if alter != '0'} # no neutral signs on normal notes
+                    if s.keyAlts:                   # only key signature if not empty
+                        k = E.Element ('key')
+                        lowerCaseSteps = set (step.upper () for step, alter in alts if step.islower ())
+                        keyAlts = sorted (s.keyAlts.items ())
+                        for step, alter in keyAlts:
+                            addElemT (k, 'key-step', step, lev + 2)
+                            addElemT (k, 'key-alter', alter, lev + 2)
+                        for step, alter in keyAlts:
+                            e = E.Element ('key-octave', number='5' if step in lowerCaseSteps else '4')
                             addElem (k, e, lev + 2)
                         atts.append ((2, k))
                 elif mode:
@@ -1462,8 +1625,8 @@ class MusicXml:
 
     def doTempo (s, maat, field, lev):
         gstaff = s.gStaffNums.get (s.vid, 0)    # staff number of the current voice
-        t = re.search (r'(\d)/(\d\d?)\s*=\s*(\d[.\d]*)|(\d[.\d]*)', field)
-        rtxt = re.search (r'"([^"]*)"', field) # look for text in Q: field
+        t = tempo_val.search (field)
+        rtxt = tempo_txt.search (field) if '"' in field else None  # look for text in Q: field
         if not t and not rtxt: return
         elems = []  # [(element, sub-elements)] will be added as direction-types
         if rtxt:
@@ -1517,14 +1680,13 @@ class MusicXml:
         addElem (maat, b, lev)
 
     def doChordSym (s, maat, sym, lev):
-        alterMap = {'#':'1','=':'0','b':'-1'}
         rnt = sym.root.t
         chord = E.Element ('harmony')
         addElem (maat, chord, lev)
         root = E.Element ('root')
         addElem (chord, root, lev + 1)
         addElemT (root, 'root-step', rnt[0], lev + 2)
-        if len (rnt) == 2: addElemT (root, 'root-alter', alterMap [rnt[1]], lev + 2)
+        if len (rnt) == 2: addElemT (root, 'root-alter', s.chordAltTab [rnt[1]], lev + 2)
         kind = s.chordTab.get (sym.kind.t[0], 'major')
         addElemT (chord, 'kind', kind, lev + 1)
         degs = getattr (sym, 'degree', '')
@@ -1532,9 +1694,8 @@ class MusicXml:
             if type (degs) != list_type: degs = [degs]
             for deg in degs:
                 deg = deg.t[0]
-                if deg[0] == '#':   alter = '1';  deg = deg[1:]
-                elif deg[0] == 'b': alter = '-1'; deg = deg[1:]
-                else:               alter = '0';  deg = deg
+                if deg[0] in '#b':  alter = s.chordAltTab [deg[0]]; deg = deg[1:]
+                else:               alter = '0'
                 degree = E.Element ('degree')
                 addElem (chord, degree, lev + 1)
                 addElemT (degree, 'degree-value', deg, lev + 2)
@@ -1546,75 +1707,78 @@ class MusicXml:
         s.ntup, s.trem, s.intrem = -1, 0, 0
         s.acciatura = 0 # next grace element gets acciatura attribute
         overlay = 0
+        lev1 = lev + 1  # level of the elements of the measure
         maat = E.Element ('measure', number = str(i))
-        if fieldmap: s.doFields (maat, fieldmap, lev + 1)
+        if fieldmap: s.doFields (maat, fieldmap, lev1)
         if s.linebrk:   # there was a line break in the previous measure
             e = E.Element ('print')
             e.set ('new-system', 'yes')
-            addElem (maat, e, lev + 1)
+            addElem (maat, e, lev1)
             s.linebrk = 0
         for it, x in enumerate (t):
-            if x.name == 'note' or x.name == 'rest':
+            name = x.name
+            if name == 'note' or name == 'rest':
                 if x.dur.t[0] == 0:  # a leading zero was used for stemmless in abcm2ps, we only support !stemless!
                     x.dur.t = tuple ([1, x.dur.t[1]])
-                note = s.mkNote (x, lev + 1)
-                addElem (maat, note, lev + 1)
-            elif x.name == 'lbar':
+                note = s.mkNote (x, lev1)
+                addElem (maat, note, lev1)
+            elif name == 'lbar':
                 bar = x.t[0]
                 if bar == '|' or bar == '[|': pass # skip redundant bar
                 elif ':' in bar:    # forward repeat
                     volta = x.t[1] if len (x.t) == 2  else ''
-                    s.mkBarline (maat, 'left', lev + 1, style='heavy-light', dir='forward', ending=volta)
+                    s.mkBarline (maat, 'left', lev1, style='heavy-light', dir='forward', ending=volta)
                 else:               # bar must be a volta number
-                    s.mkBarline (maat, 'left', lev + 1, ending=bar)
-            elif x.name == 'rbar':
+                    s.mkBarline (maat, 'left', lev1, ending=bar)
+            elif name == 'rbar':
                 bar = x.t[0]
                 if bar == '.|':
-                    s.mkBarline (maat, 'right', lev + 1, style='dotted')
+                    s.mkBarline (maat, 'right', lev1, style='dotted')
                 elif ':' in bar:  # backward repeat
-                    s.mkBarline (maat, 'right', lev + 1, style='light-heavy', dir='backward')
+                    s.mkBarline (maat, 'right', lev1, style='light-heavy', dir='backward')
                 elif bar == '||':
-                    s.mkBarline (maat, 'right', lev + 1, style='light-light')
+                    s.mkBarline (maat, 'right', lev1, style='light-light')
                 elif bar == '[|]' or bar == '[]':
-                    s.mkBarline (maat, 'right', lev + 1, style='none')
+                    s.mkBarline (maat, 'right', lev1, style='none')
                 elif '[' in bar or ']' in bar:
-                    s.mkBarline (maat, 'right', lev + 1, style='light-heavy')
+                    s.mkBarline (maat, 'right', lev1, style='light-heavy')
                 elif bar[0] == '&': overlay = 1
-            elif x.name == 'tup':
+            elif name == 'tup':
                 if len (x.t) == 3:  n, into, nts = x.t
                 else:               n, into, nts = x.t[0], 0, 0
                 if into == 0: into = 3 if n in [2,4,8] else 2
                 if nts == 0: nts = n
                 s.tmnum, s.tmden, s.ntup = n, into, nts
-            elif x.name == 'deco':
-                s.staffDecos (x.t, maat, lev + 1)   # output staff decos, postpone note decos to next note
-            elif x.name == 'text':
+            elif name == 'deco':
+                s.staffDecos (x.t, maat, lev1)   # output staff decos, postpone note decos to next note
+            elif name == 'text':
                 pos, text = x.t[:2]
                 place = 'above' if pos == '^' else 'below'
                 words = E.Element ('words')
                 words.text = text
                 gstaff = s.gStaffNums.get (s.vid, 0)    # staff number of the current voice
-                addDirection (maat, words, lev + 1, gstaff, placement=place)
-            elif x.name == 'inline':
+                addDirection (maat, words, lev1, gstaff, placement=place)
+            elif name == 'inline':
                 fieldtype, fieldval = x.t[0], ' '.join (x.t[1:])
-                s.doFields (maat, {fieldtype:fieldval}, lev + 1)
-            elif x.name == 'accia': s.acciatura = 1
-            elif x.name == 'linebrk':
+                s.doFields (maat, {fieldtype:fieldval}, lev1)
+            elif name == 'accia': s.acciatura = 1
+            elif name == 'linebrk':
                 s.supports_tag = 1
                 if it > 0 and t[it -1].name == 'lbar':  # we are at start of measure
                     e = E.Element ('print')             # output linebreak now
                     e.set ('new-system', 'yes')
-                    addElem (maat, e, lev + 1)
+                    addElem (maat, e, lev1)
                 else:
                     s.linebrk = 1   # output linebreak at start of next measure
-            elif x.name == 'chordsym':
-                s.doChordSym (maat, x, lev + 1)
+            elif name == 'chordsym':
+                s.doChordSym (maat, x, lev1)
         s.stopBeams ()
         s.prevmsre = maat
         return maat, overlay
 
     def mkPart (s, maten, id, lev, attrs, nstaves, rOpt):
         s.slurstack = []
+        s.tieslur = 0           # 1 when a tie has been converted to a slur, slur_max has to be recomputed
         s.glisnum = 0;          # xml number attribute for glissandos
         s.slidenum = 0;         # xml number attribute for slides
         s.unitLcur = s.unitL    # set the default unit length at begin of each voice
@@ -1636,15 +1800,22 @@ class MusicXml:
         if 'perc' in attrs_cpy.get ('V', ''): del attrs_cpy ['K'] # remove key from percussion voice
         msre, overlay = s.mkMeasure (1, maten[0], lev + 1, attrs_cpy)
         addElem (part, msre, lev + 1)
+        slur_max = maxSlurNum (msre)    # highest slur number in part, for renumbering overlays
         for i, maat in enumerate (maten[1:]):
             s.overlayVnum = s.overlayVnum + 1 if overlay else 0
             msre, next_overlay = s.mkMeasure (i+2, maat, lev + 1)
-            if overlay: mergePartMeasure (part, msre, s.overlayVnum, rOpt)
-            else:       addElem (part, msre, lev + 1)
+            if overlay:
+                if s.tieslur:       # converted ties can be slurs in earlier measures, not counted in slur_max
+                    slur_max = maxSlurNum (part, 'measure/note/notations/slur')
+                    s.tieslur = 0
+                slur_max = mergePartMeasure (part, msre, slur_max, s.overlayVnum, rOpt)
+            else:
+                addElem (part, msre, lev + 1)
+                slur_max = max (slur_max, maxSlurNum (msre))
             overlay = next_overlay
         return part
 
-    def mkScorePart (s, id, vids_p, partAttr, lev):
+    def mkScorePart (s, id, insts, partAttr, lev):   # insts = sorted [(inst_id, instrument)] of this part
         def mkInst (instId, vid, midchan, midprog, midnot, vol, pan, lev):
             si = E.Element ('score-instrument', id=instId)
             addElemT (si, 'instrument-name', partAttr.get (vid, [''])[0], lev + 2)
@@ -1664,9 +1835,9 @@ class MusicXml:
         snm.text = subnm
         if subnm: addElem (sp, snm, lev + 1)    # only add if subname was given
         inst = []
-        for instId, (pid, vid, chan, midprg, vol, pan) in sorted (s.midiInst.items ()):
+        for instId, (pid, vid, chan, midprg, vol, pan) in insts:
             midprg, midnot = ('0', midprg) if chan == '10' else (midprg, '')
-            if pid == id: inst.append (mkInst (instId, vid, chan, midprg, midnot, vol, pan, lev))
+            inst.append (mkInst (instId, vid, chan, midprg, midnot, vol, pan, lev))
         for si, mi in inst: addElem (sp, si, lev + 1)
         for si, mi in inst: addElem (sp, mi, lev + 1)
         return sp
@@ -1679,6 +1850,8 @@ class MusicXml:
             addElemT (pg, 'group-barline', 'yes', lev + 2)
         partlist = E.Element ('part-list')
         g_num = 0       # xml group number
+        partInsts = {}  # part_id -> [(inst_id, instrument)], sorted once for all parts
+        for instId, inst in sorted (s.midiInst.items ()): partInsts.setdefault (inst[0], []).append ((instId, inst))
         for g in (s.groups or vids):    # brace/bracket or abc_voice_id
             if   g == '[': g_num += 1; addPartGroup ('bracket', g_num)
             elif g == '{': g_num += 1; addPartGroup ('brace', g_num)
@@ -1688,7 +1861,7 @@ class MusicXml:
                 g_num -= 1
             else:   # g = abc_voice_id
                 if g not in vids: continue  # error in %%score
-                sp = s.mkScorePart (g, vids, partAttr, lev + 1)
+                sp = s.mkScorePart (g, partInsts.get (g, []), partAttr, lev + 1)
                 addElem (partlist, sp, lev + 1)
         return partlist
 
@@ -1698,11 +1871,10 @@ class MusicXml:
             if midprog and midprog != s.midprg [1]: instDir ('midi-program', str (int (midprog) + 1), 'prog: %s')
         def readPfmt (x, n): # read ABC page formatting constant
             if not s.pageFmtAbc: s.pageFmtAbc = s.pageFmtDef    # set the default values on first change
-            ro = re.search (r'[^.\d]*([\d.]+)\s*(cm|in|pt)?', x)    # float followed by unit
+            ro = pfmt_val.search (x)    # float followed by unit
             if ro:
                 x, unit = ro.groups ()  # unit == None when not present
-                u = {'cm':10., 'in':25.4, 'pt':25.4/72} [unit] if unit else 1.
-                s.pageFmtAbc [n] = float (x) * u   # convert ABC values to millimeters
+                s.pageFmtAbc [n] = float (x) * s.unitTab [unit]    # convert ABC values to millimeters
             else: info ('error in page format: %s' % x)
         def readPercMap (x):    # parse I:percmap <abc_note> <step> <MIDI> <notehead>
             def getMidNum (sndnm):          # find midi number of GM drum sound name
@@ -1716,7 +1888,8 @@ class MusicXml:
                 return ps [0][1]            # midi number of (first) instrument found
             def midiVal (acc, step, oct):   # abc note -> midi note number
                 oct = (4 if step.upper() == step else 5) + int (oct)
-                return oct * 12 + [0,2,4,5,7,9,11]['CDEFGAB'.index (step.upper())] + {'^':1,'_':-1,'=':0}.get (acc, 0) + 12
+                shift, _ = s.percAccTab.get (acc, (0, 'normal'))   # same semitone shift as in mkPitch
+                return oct * 12 + s.semiTab [step.upper ()] + shift + 12
             p0, p1, p2, p3, p4 = abc_percmap.parseString (x).asList ()  # percmap, abc-note, display-step, midi, note-head
             acc, astep, aoct = p1
             nstep, noct = (astep, aoct) if p2 == '*' else p2
@@ -1724,13 +1897,13 @@ class MusicXml:
             elif isinstance (p3, list_type):        midi = str (midiVal (p3[0], p3[1], p3[2]))
             elif isinstance (p3, int_type):         midi = str (p3)
             else:                                   midi = getMidNum (p3.lower ())
-            head = re.sub (r'(.)-([^x])', r'\1 \2', p4) # convert abc note head names to xml
+            head = perc_head.sub (r'\1 \2', p4) # convert abc note head names to xml
             s.percMap [(s.pid, acc + astep, aoct)] = (nstep, noct, midi, head)
         if x.startswith ('score') or x.startswith ('staves'):
             s.staveDefs += [x]          # collect all voice mappings
         elif x.startswith ('staffwidth'): info ('skipped I-field: %s' % x)
         elif x.startswith ('staff'):    # set new staff number of the current voice
-            r1 = re.search (r'staff *([+-]?)(\d)', x)
+            r1 = staff_redir.search (x)
             if r1:
                 sign = r1.group (1)
                 num = int (r1.group (2))
@@ -1745,18 +1918,14 @@ class MusicXml:
                     s.gStaffNums [s.vid] = num
                 else: info ('could not relocate to staff: %s' % r1.group ())
             else: info ('not a valid staff redirection: %s' % x)
-        elif x.startswith ('scale'): readPfmt (x, 0)
-        elif x.startswith ('pageheight'): readPfmt (x, 1)
-        elif x.startswith ('pagewidth'): readPfmt (x, 2)
-        elif x.startswith ('leftmargin'): readPfmt (x, 3)
-        elif x.startswith ('rightmargin'): readPfmt (x, 4)
-        elif x.startswith ('topmargin'): readPfmt (x, 5)
-        elif x.startswith ('botmargin'): readPfmt (x, 6)
-        elif x.startswith ('MIDI') or x.startswith ('midi'):
-            r1 = re.search (r'program *(\d*) +(\d+)', x)
-            r2 = re.search (r'channel *(\d+)', x)
-            r3 = re.search (r"drummap\s+([_=^]*)([A-Ga-g])([,']*)\s+(\d+)", x)
-            r4 = re.search (r'control *(\d+) +(\d+)', x)
+        elif x.startswith (s.pageFmtNms):  # one test for all page formatting directives
+            for n, nm in enumerate (s.pageFmtNms):
+                if x.startswith (nm): readPfmt (x, n); break
+        elif x.startswith (('MIDI', 'midi')):
+            r1 = midi_program.search (x)
+            r2 = midi_channel.search (x)
+            r3 = midi_drummap.search (x)
+            r4 = midi_control.search (x)
             ch_nw, prg_nw, vol_nw, pan_nw = '', '', '', ''
             if r1: ch_nw, prg_nw = r1.groups () # channel nr or '', program nr
             if r2: ch_nw = r2.group (1)         # channel nr only
@@ -1777,7 +1946,7 @@ class MusicXml:
                 oct = -len (oct) if ',' in x else len (oct)
                 notehead = 'x' if acc == '^' else 'circle-x' if acc == '_' else 'normal'
                 s.percMap [(s.pid, acc + step, oct)] = (step, oct, midi, notehead)
-            r = re.search (r'transpose[^-\d]*(-?\d+)', x)
+            r = midi_transpose.search (x)
             if r: addTrans (r.group (1))        # addTrans -> doFields
         elif x.startswith ('percmap'): readPercMap (x); s.pMapFound = 1
         else: info ('skipped I-field: %s' % x)
@@ -1788,13 +1957,10 @@ class MusicXml:
         for x in s.staveDefs [1:]: info ('%%%%%s dropped, multiple stave mappings not supported' % x)
         x = s.staveDefs [0]                                 # only the first %%score is honoured
         score = abc_scoredef.parseString (x) [0]
-        f = lambda x: type (x) == uni_type and [x] or x
-        s.staves = lmap (f, mkStaves (score, vdefs))        # [[vid] for each staff]
-        s.grands = lmap (f, mkGrand (score, vdefs))         # [staff-id], staff-id == [vid][0]
+        s.staves = [[x] if type (x) == uni_type else x for x in mkStaves (score, vdefs)]  # [[vid] for each staff]
+        s.grands = [[x] if type (x) == uni_type else x for x in mkGrand (score, vdefs)]   # [staff-id], staff-id == [vid][0]
         s.groups = mkGroups (score)
-        vce_groups = [vids for vids in s.staves if len (vids) > 1]  # all voice groups
-        d = {}                                              # for each voice group: map first voice id -> all merged voice ids
-        for vgr in vce_groups: d [vgr[0]] = vgr
+        d = {vgr[0]: vgr for vgr in s.staves if len (vgr) > 1}    # for each voice group: map first voice id -> all merged voice ids
         for gstaff in s.grands:                             # for all grand staves
             if len (gstaff) == 1: continue                  # skip single parts
             for v, stf_num in zip (gstaff, range (1, len (gstaff) + 1)):
@@ -1816,9 +1982,9 @@ class MusicXml:
                 vdefs [vid] =  pname, psubnm, ''
             else:                   # abc with voice definitions
                 if vid != vcedef.t[1]: info ('voice ids unequal: %s (reg-ex) != %s (grammar)' % (vid, vcedef.t[1]))
-                rn = re.search (r'(?:name|nm)="([^"]*)"', vcedef.t[2])
+                rn = voice_name.search (vcedef.t[2])
                 if rn: pname = rn.group (1)
-                rn = re.search (r'(?:subname|snm|sname)="([^"]*)"', vcedef.t[2])
+                rn = voice_subname.search (vcedef.t[2])
                 if rn: psubnm = rn.group (1)
                 vcedef.t[2] = vcedef.t[2].replace ('"%s"' % pname, '""').replace ('"%s"' % psubnm, '""')   # clear voice name to avoid false clef matches later on
                 vdefs [vid] =  pname, psubnm, vcedef.t[2]
@@ -1933,23 +2099,32 @@ class MusicXml:
         try:
             lbrk_insert = 0 if re.search (r'I:linebreak\s*([!$]|none)|I:continueall\s*(1|true)', header) else bOpt
             hs = abc_header.parseString (header) if header else ''
+            jobs = []
             for id, voice in voices:
                 if lbrk_insert:                                 # insert linebreak at EOL
                     r1 = re.compile (r'\[[wA-Z]:[^]]*\]')       # inline field
                     has_abc = lambda x: r1.sub ('', x).strip () # empty if line only contains inline fields
                     voice = '\n'.join ([balk.rstrip ('$!') + '$' if has_abc (balk) else balk for balk in voice.splitlines ()])
+                orderChords = s.fOpt and ('tab' in voice [:200] or [x for x in hs if x.t[0] == 'K' and 'tab' in x.t[1]])
+                jobs.append ((voice, orderChords))
+            vces = parseVoices (jobs)
+            for (id, _), (voice, orderChords), (vce, msgs) in zip (voices, jobs, vces):
                 prevLeftBar = None      # previous voice ended with a left-bar symbol (double repeat)
-                s.orderChords = s.fOpt and ('tab' in voice [:200] or [x for x in hs if x.t[0] == 'K' and 'tab' in x.t[1]])
-                vce = abc_voice.parseString (voice).asList ()
+                s.orderChords = orderChords
+                for msg, warn in msgs: info (msg, warn)     # messages of a worker process, in voice order
+                abc_voice.beam ['prevloc'] = 0  # each voice starts at its own first note, as in the worker processes
+                if vce is None: vce = parseSimpleVoice (voice, abc_voice.beam)    # plain note runs bypass the grammar
+                if vce is None: vce = abc_voice.parseString (voice).asList ()
                 lyr_notes = []          # remember notes between lyric blocks
-                for m in vce:           # all measures
-                    for e in m:         # all abc-elements
-                        if e.name == 'lyr_blk':         # -> e.objs is list of lyric lines
-                            lyr = [line.objs for line in e.objs]    # line.objs is listof syllables
-                            alignLyr (lyr_notes, lyr)   # put all syllables into corresponding notes
-                            lyr_notes = []
-                        else:
-                            lyr_notes.append (e)
+                if lyr_field.search (voice):    # w: fields are inline here, no need to walk the voice when there are none
+                    for m in vce:           # all measures
+                        for e in m:         # all abc-elements
+                            if e.name == 'lyr_blk':         # -> e.objs is list of lyric lines
+                                lyr = [line.objs for line in e.objs]    # line.objs is listof syllables
+                                alignLyr (lyr_notes, lyr)   # put all syllables into corresponding notes
+                                lyr_notes = []
+                            else:
+                                lyr_notes.append (e)
                 if not vce:             # empty voice, insert an inline field that will be rejected
                     vce = [[pObj ('inline', ['I', 'empty voice'])]]
                 if prevLeftBar:
@@ -2035,13 +2210,11 @@ def decodeInput (data_string):
     return unicode_string
 
 xmlVersion = "<?xml version='1.0' encoding='utf-8'?>"    
+xmlDoctype = '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">'
 def fixDoctype (elem):
     if python3: xs = E.tostring (elem, encoding='unicode')  # writing to file will auto-encode to utf-8
     else:       xs = E.tostring (elem, encoding='utf-8')    # keep the string utf-8 encoded for writing to file
-    ys = xs.split ('\n')
-    ys.insert (0, xmlVersion)  # crooked logic of ElementTree lib
-    ys.insert (1, '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">')
-    return '\n'.join (ys)
+    return '\n'.join ((xmlVersion, xmlDoctype, xs))   # crooked logic of ElementTree lib, prepend instead of splitting all lines
 
 def xml2mxl (pad, fnm, data):   # write xml data to compressed .mxl file
     from zipfile import ZipFile, ZIP_DEFLATED